@@ -3,23 +3,33 @@ from __future__ import annotations
 import argparse
 import asyncio
 import base64
+import contextlib
+import dataclasses
 import datetime
+import functools
 import json
 import logging
 import logging.config
 import os
 import shlex
+import shutil
 import subprocess
-from enum import Enum
+import sys
+import tempfile
+import time
+from enum import IntEnum
 from typing import Any
-from typing import Collection
 from typing import Iterable
 from typing import Iterator
+from typing import Mapping
 from typing import NamedTuple
 from typing import Protocol
 from typing import Sequence
 
-import humanize
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as json_loads
 
 # -------
 # Logging
@@ -73,40 +83,39 @@ logger = logging.getLogger("gh_notifs")
 class User(NamedTuple):
     id: str
     login: str
-    teams: Collection[str]
+    team_slugs: Mapping[str, str]  # "org/slug" -> "slug"
 
 
-class PRStatus(Enum):
-    DRAFT = "DRAFT"
-    OPEN = "OPEN"
-    MERGED = "MERGED"
-    CLOSED = "CLOSED"
+class PRStatus(IntEnum):
+    DRAFT = 0
+    OPEN = 1
+    MERGED = 2
+    CLOSED = 3
 
 
-class PRMergeStatus(Enum):
-    CLEAN = "CLEAN"  # can be merged
-    AUTO_MERGE = "AUTO_MERGE"  # will be merged automatically
-    UNKNOWN = "UNKNOWN"
+class PRMergeStatus(IntEnum):
+    CLEAN = 0  # can be merged
+    AUTO_MERGE = 1  # will be merged automatically
+    UNKNOWN = 2
 
 
-class PR(NamedTuple):
+@dataclasses.dataclass(frozen=True, slots=True)
+class PR:
     title: str
     author: str
 
-    state: str
-    draft: bool
-    merged: bool
-    mergeable_state: str
-    auto_merge: bool
+    status: PRStatus
+    merge_status: PRMergeStatus
 
     owner: str
     repo: str
     base_ref: str
     base_default_branch: str
     number: str
+    ref: str  # owner/repo#number
     html_url: str
 
-    updated_at_str: str
+    updated_at: datetime.datetime
 
     requested_reviewers: list[str]
 
@@ -115,93 +124,120 @@ class PR(NamedTuple):
     additions: int
     deletions: int
 
-    @property
-    def status(self) -> PRStatus:
-        if self.state == "open":
-            if self.draft:
+    @staticmethod
+    def _status_from_graphql(data: dict[str, Any]) -> PRStatus:
+        if data["state"] == "OPEN":
+            if data["isDraft"]:
                 return PRStatus.DRAFT
             else:
                 return PRStatus.OPEN
-        elif self.state == "closed":
-            if self.merged:
-                return PRStatus.MERGED
-            else:
-                return PRStatus.CLOSED
+        elif data["state"] == "MERGED":
+            return PRStatus.MERGED
+        elif data["state"] == "CLOSED":
+            return PRStatus.CLOSED
         else:
-            raise ValueError(f"Unrecognised state: {self.state}")
+            raise ValueError(f"Unrecognised state: {data['state']}")
 
-    @property
-    def merge_status(self) -> PRMergeStatus:
-        if self.mergeable_state == "clean":
+    @staticmethod
+    def _merge_status_from_graphql(data: dict[str, Any]) -> PRMergeStatus:
+        if data["mergeStateStatus"] == "CLEAN":
             return PRMergeStatus.CLEAN
-        elif self.auto_merge:
+        elif data["autoMergeRequest"] is not None:
             return PRMergeStatus.AUTO_MERGE
-        elif self.mergeable_state in {
-            "behind",
-            "blocked",
-            "dirty",
-            "unknown",
-            "unstable",
+        elif data["mergeStateStatus"] in {
+            "BEHIND",
+            "BLOCKED",
+            "DIRTY",
+            "DRAFT",
+            "HAS_HOOKS",
+            "UNKNOWN",
+            "UNSTABLE",
         }:
             return PRMergeStatus.UNKNOWN
         else:
-            raise ValueError(f"Unrecognised mergeable state: {self.mergeable_state}")
-
-    @property
-    def ref(self) -> str:
-        return f"{self.owner}/{self.repo}#{self.number}"
+            raise ValueError(
+                f"Unrecognised merge state status: {data['mergeStateStatus']}"
+            )
 
-    @property
-    def updated_at(self) -> datetime.datetime:
-        updated_at_str = self.updated_at_str.replace("Z", "+00:00")
-        updated_at = datetime.datetime.fromisoformat(updated_at_str)
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _parse_timestamp(timestamp: str) -> datetime.datetime:
+        # GitHub timestamps are always in UTC: YYYY-MM-DDTHH:MM:SSZ
+        updated_at = datetime.datetime(
+            int(timestamp[0:4]),
+            int(timestamp[5:7]),
+            int(timestamp[8:10]),
+            int(timestamp[11:13]),
+            int(timestamp[14:16]),
+            int(timestamp[17:19]),
+            tzinfo=datetime.timezone.utc,
+        )
 
         # convert to local time and then remove the timezone info
         return updated_at.astimezone().replace(tzinfo=None)
 
     @classmethod
-    def from_json(cls, data: dict[str, Any]) -> PR:
-        owner = data["base"]["repo"]["owner"]["login"]
+    def from_graphql(cls, data: dict[str, Any]) -> PR:
+        base_repo = data["baseRepository"]
+        owner = base_repo["owner"]["login"]
+        repo = base_repo["name"]
+        number = data["number"]
         return cls(
             title=data["title"],
-            author=data["user"]["login"],
-            state=data["state"],
-            draft=data["draft"],
-            merged=data["merged"],
-            mergeable_state=data["mergeable_state"],
-            auto_merge=bool(data["auto_merge"]),
+            # deleted accounts have no author; the REST API calls them "ghost"
+            author=(data["author"] or {"login": "ghost"})["login"],
+            status=cls._status_from_graphql(data),
+            merge_status=cls._merge_status_from_graphql(data),
             owner=owner,
-            repo=data["base"]["repo"]["name"],
-            base_ref=data["base"]["ref"],
-            base_default_branch=data["base"]["repo"]["default_branch"],
-            number=data["number"],
-            html_url=data["html_url"],
-            updated_at_str=data["updated_at"],
+            repo=repo,
+            base_ref=data["baseRefName"],
+            base_default_branch=base_repo["defaultBranchRef"]["name"],
+            number=number,
+            ref=f"{owner}/{repo}#{number}",
+            html_url=data["url"],
+            updated_at=cls._parse_timestamp(data["updatedAt"]),
             requested_reviewers=[
-                *(reviewer["login"] for reviewer in data["requested_reviewers"]),
-                *(f"{owner}/{team['slug']}" for team in data["requested_teams"]),
+                (
+                    reviewer["login"]
+                    if "login" in reviewer
+                    else f"{owner}/{reviewer['slug']}"
+                )
+                for node in data["reviewRequests"]["nodes"]
+                # the API can return a null reviewer
+                if (reviewer := node["requestedReviewer"]) is not None
             ],
-            commits=data["commits"],
-            files=data["changed_files"],
+            commits=data["commits"]["totalCount"],
+            files=data["changedFiles"],
             additions=data["additions"],
             deletions=data["deletions"],
         )
 
 
-class Notification(NamedTuple):
+# the binary header of a notification referrer id, before the
+# "<notification id>:<user id>" payload
+REFERRER_ID_PREFIX = b"\x93\x00\xce\x00s3\xa2\xb2"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Notification:
     id: str
     user: User
     pr: PR
+    url: str = dataclasses.field(init=False)
 
-    @property
-    def url(self) -> str:
-        prefix = b"\x93\x00\xce\x00s3\xa2\xb2"
-        token = (
-            base64.standard_b64encode(prefix + f"{self.id}:{self.user.id}".encode())
-            .decode()
-            .rstrip("=")
+    def __post_init__(self) -> None:
+        payload = REFERRER_ID_PREFIX + b":".join(
+            (self.id.encode("ascii"), self.user.id.encode("ascii"))
+        )
+        encoded = base64.b64encode(payload)
+        # the padding length is known up front, so slice it off without scanning
+        padding = -len(payload) % 3
+        token = encoded[: len(encoded) - padding].decode("ascii")
+        # the dataclass is frozen, so set the derived field the way its own
+        # __init__ would
+        object.__setattr__(
+            self, "url", f"{self.pr.html_url}?notification_referrer_id=NT_{token}"
         )
-        return f"{self.pr.html_url}?notification_referrer_id=NT_{token}"
 
 
 # ----------
@@ -209,28 +245,67 @@ class Notification(NamedTuple):
 # ----------
 
 
+# (unit, used from this many seconds, seconds per unit); years take over from
+# 12 * 30 days so that there is never a "12 months ago"
+TIME_UNITS = (
+    ("second", 1, 1),
+    ("minute", 60, 60),
+    ("hour", 60 * 60, 60 * 60),
+    ("day", 24 * 60 * 60, 24 * 60 * 60),
+    ("month", 30 * 24 * 60 * 60, 30 * 24 * 60 * 60),
+    ("year", 360 * 24 * 60 * 60, 365 * 24 * 60 * 60),
+)
+
+
+@functools.lru_cache(maxsize=512)
+def _naturaltime(dt: datetime.datetime, now: datetime.datetime) -> str:
+    seconds = int((now - dt).total_seconds())
+    if seconds < 1:
+        return "now"
+
+    unit, length = next(
+        (unit, length)
+        for unit, start, length in reversed(TIME_UNITS)
+        if seconds >= start
+    )
+    count = max(seconds // length, 1)
+    if count == 1:
+        return f"{'an' if unit == 'hour' else 'a'} {unit} ago"
+    else:
+        return f"{count} {unit}s ago"
+
+
+def _status_key(
+    status: PRStatus, merge_status: PRMergeStatus
+) -> tuple[PRStatus, PRMergeStatus | None]:
+    # the merge status only matters while the PR is open
+    return status, merge_status if status is PRStatus.OPEN else None
+
+
 class Formatter(Protocol):
     def format(self, notifications: Iterable[Notification]) -> str: ...
 
 
 class ConsoleFormatter:
-    @staticmethod
-    def _format_notification(notif: Notification) -> str:  # noqa: C901
-        if notif.pr.status == PRStatus.OPEN:
-            if notif.pr.merge_status == PRMergeStatus.CLEAN:
-                status = "\x1b[92m\uf00c\x1b[0m "
-            elif notif.pr.merge_status == PRMergeStatus.AUTO_MERGE:
-                status = "\u23e9"
-            else:
-                status = ""
-        elif notif.pr.status == PRStatus.DRAFT:
-            status = "\x1b[39;2m"
-        elif notif.pr.status == PRStatus.MERGED:
-            status = "\x1b[35m[M]\x1b[39;2m"
-        elif notif.pr.status == PRStatus.CLOSED:
-            status = "\x1b[31m[C]\x1b[39;2m"
-        else:
-            raise ValueError(f"{notif.pr.status=}")
+    STATUSES: dict[tuple[PRStatus, PRMergeStatus | None], str] = {
+        (PRStatus.OPEN, PRMergeStatus.CLEAN): "\x1b[92m\uf00c\x1b[0m ",
+        (PRStatus.OPEN, PRMergeStatus.AUTO_MERGE): "\u23e9",
+        (PRStatus.OPEN, PRMergeStatus.UNKNOWN): "",
+        (PRStatus.DRAFT, None): "\x1b[39;2m",
+        (PRStatus.MERGED, None): "\x1b[35m[M]\x1b[39;2m",
+        (PRStatus.CLOSED, None): "\x1b[31m[C]\x1b[39;2m",
+    }
+    NOTIFICATION_TEMPLATE = """\
+%s \x1b[1m%s\x1b[0m (%s)
+    by %s -- updated %s -- (%s commits, %s files) [\x1b[92m+%s\x1b[0m \x1b[91m-%s\x1b[0m] %s
+    \x1b[2m%s\x1b[0m
+    \x1b[2m%s\x1b[0m
+"""  # noqa: E501
+
+    def _write_notification(
+        self, parts: list[str], notif: Notification, now: datetime.datetime
+    ) -> None:
+        status = self.STATUSES[_status_key(notif.pr.status, notif.pr.merge_status)]
 
         if notif.pr.base_ref != notif.pr.base_default_branch:
             base_ref = f" {notif.pr.base_ref}"
@@ -242,88 +317,128 @@ class ConsoleFormatter:
         else:
             author = notif.pr.author
 
+        login, team_slugs = notif.user.login, notif.user.team_slugs
         reviewers, n_other_reviewers = [], 0
         for reviewer in notif.pr.requested_reviewers:
-            if reviewer == notif.user.login:
+            if reviewer == login:
                 reviewers.append(f"\x1b[33m{reviewer}\x1b[39m")
-            elif reviewer in notif.user.teams:
-                _org, _, slug = reviewer.partition("/")
-                reviewers.append(f"{slug}")
+            elif reviewer in team_slugs:
+                reviewers.append(team_slugs[reviewer])
             else:
                 n_other_reviewers += 1
 
         if n_other_reviewers:
             reviewers.append(f"{n_other_reviewers} others")
 
-        return f"""\
-{status} \x1b[1m{notif.pr.title}\x1b[0m ({notif.pr.ref})
-    by {author} -- updated {humanize.naturaltime(notif.pr.updated_at)} -- ({notif.pr.commits} commits, {notif.pr.files} files) [\x1b[92m+{notif.pr.additions}\x1b[0m \x1b[91m-{notif.pr.deletions}\x1b[0m] {base_ref}
-    \x1b[2m{', '.join(reviewers)}\x1b[0m
-    \x1b[2m{notif.url}\x1b[0m
-"""  # noqa: E501
+        parts.append(
+            self.NOTIFICATION_TEMPLATE
+            % (
+                status,
+                notif.pr.title,
+                notif.pr.ref,
+                author,
+                _naturaltime(notif.pr.updated_at, now),
+                notif.pr.commits,
+                notif.pr.files,
+                notif.pr.additions,
+                notif.pr.deletions,
+                base_ref,
+                ", ".join(reviewers),
+                notif.url,
+            )
+        )
 
     def format(self, notifications: Iterable[Notification]) -> str:
-        return "\n".join(
-            self._format_notification(notification) for notification in notifications
-        )
+        now = datetime.datetime.now()
+        parts: list[str] = []
+        for i, notification in enumerate(notifications):
+            if i:
+                parts.append("\n")
+            self._write_notification(parts, notification, now)
+        return "".join(parts)
 
 
 class HtmlFormatter:
+    LI_CLASSES: dict[PRStatus, str] = {
+        PRStatus.DRAFT: "list-group-item-light",
+        PRStatus.CLOSED: "list-group-item-danger",
+    }
+    LI_STYLES: dict[PRStatus, str] = {
+        PRStatus.MERGED: "color: #2c1a4d; background-color: #c5b3e6;",
+    }
+    ICONS: dict[tuple[PRStatus, PRMergeStatus | None], tuple[str, ...]] = {
+        (PRStatus.OPEN, PRMergeStatus.CLEAN): (
+            '<i class="bi bi-check-circle-fill text-success fs-3 p-2" '
+            'style="float: right;" title="has been approved"></i>',
+        ),
+        (PRStatus.OPEN, PRMergeStatus.AUTO_MERGE): (
+            '<i class="bi bi-fast-forward-circle fs-3 p-2" '
+            'style="float: right; color: #6f42c1;" '
+            'title="auto-merge enabled"></i>',
+        ),
+        (PRStatus.OPEN, PRMergeStatus.UNKNOWN): (),
+        (PRStatus.DRAFT, None): (
+            '<i class="bi bi-pencil text-secondary fs-3 p-2" '
+            'style="float: right;" title="draft"></i>',
+        ),
+        (PRStatus.CLOSED, None): (
+            '<i class="bi bi-x-circle text-danger fs-3 p-2" '
+            'style="float: right;" title="closed"></i>',
+        ),
+        (PRStatus.MERGED, None): (
+            '<i class="bi bi-sign-merge-right fs-3 p-2" '
+            'style="float: right; color: #6f42c1;" title="merged"></i>',
+        ),
+    }
+    AUTHOR_ICON = (
+        '<i class="bi bi-person-circle text-warning fs-3 p-2" '
+        'style="float: right;" title="i am the author"></i>'
+    )
+    NOTIFICATION_TEMPLATE = """\
+<li class="list-group-item %s" style="%s">
+    <p class="mb-1">
+      <small class="lh-2">
+        <span style="float: right; text-align: right;">
+          <span>%s</span>
+          <br>
+          <small>%s</small>
+        </span>
+        <a href="%s" target="_blank">%s</a>
+        by %s
+        <br/>
+        <span>%s</span>
+      </small>
+    </p>
+  <h5 class="mb-1">
+    %s
+  </h5>
+  <div>
+    <p class="mb-1">
+      %s
+      <span class="text-success">+%s</span>
+      <span class="text-danger">−%s</span>
+      in %s commits, %s files.
+    </p>
+    <small>
+      <ul class="list-group list-group-horizontal">
+        %s
+      </ul>
+    </small>
+  </div>
+</li>
+"""
+
     def __init__(self, auto_refresh: bool, theme: str) -> None:
         self.auto_refresh = auto_refresh
         self.theme = theme
 
-    @staticmethod
-    def _li_class(notif: Notification) -> str:
-        if notif.pr.status == PRStatus.DRAFT:
-            return "list-group-item-light"
-        elif notif.pr.status == PRStatus.CLOSED:
-            return "list-group-item-danger"
-        else:
-            return ""
+    def _icons(
+        self, status: PRStatus, merge_status: PRMergeStatus, is_author: bool
+    ) -> Iterator[str]:
+        yield from self.ICONS[_status_key(status, merge_status)]
 
-    @staticmethod
-    def _li_style(notif: Notification) -> str:
-        if notif.pr.status == PRStatus.MERGED:
-            return "color: #2c1a4d; background-color: #c5b3e6;"
-        else:
-            return ""
-
-    @staticmethod
-    def _icons(notif: Notification) -> Iterator[str]:
-        if notif.pr.status == PRStatus.OPEN:
-            if notif.pr.merge_status == PRMergeStatus.CLEAN:
-                yield (
-                    '<i class="bi bi-check-circle-fill text-success fs-3 p-2" '
-                    'style="float: right;" title="has been approved"></i>'
-                )
-            if notif.pr.merge_status == PRMergeStatus.AUTO_MERGE:
-                yield (
-                    '<i class="bi bi-fast-forward-circle fs-3 p-2" '
-                    'style="float: right; color: #6f42c1;" '
-                    'title="auto-merge enabled"></i>'
-                )
-        elif notif.pr.status == PRStatus.DRAFT:
-            yield (
-                '<i class="bi bi-pencil text-secondary fs-3 p-2" '
-                'style="float: right;" title="draft"></i>'
-            )
-        elif notif.pr.status == PRStatus.CLOSED:
-            yield (
-                '<i class="bi bi-x-circle text-danger fs-3 p-2" '
-                'style="float: right;" title="closed"></i>'
-            )
-        elif notif.pr.status == PRStatus.MERGED:
-            yield (
-                '<i class="bi bi-sign-merge-right fs-3 p-2" '
-                'style="float: right; color: #6f42c1;" title="merged"></i>'
-            )
-
-        if notif.pr.author == notif.user.login:
-            yield (
-                '<i class="bi bi-person-circle text-warning fs-3 p-2" '
-                'style="float: right;" title="i am the author"></i>'
-            )
+        if is_author:
+            yield self.AUTHOR_ICON
 
     @staticmethod
     def _target_branch(pr: PR) -> str:
@@ -338,16 +453,16 @@ class HtmlFormatter:
 
     @staticmethod
     def _reviewer_list_items(notif: Notification) -> Iterator[str]:
+        login, team_slugs = notif.user.login, notif.user.team_slugs
         others = []
         for reviewer in notif.pr.requested_reviewers:
-            if reviewer == notif.user.login:
+            if reviewer == login:
                 yield (
                     '<li class="list-group-item list-group-item-warning">'
                     f"{reviewer}</li>"
                 )
-            elif reviewer in notif.user.teams:
-                _org, _, slug = reviewer.partition("/")
-                yield f'<li class="list-group-item">{slug}</li>'
+            elif reviewer in team_slugs:
+                yield f'<li class="list-group-item">{team_slugs[reviewer]}</li>'
             else:
                 _org, _, slug = reviewer.rpartition("/")
                 others.append(slug)
@@ -358,43 +473,40 @@ class HtmlFormatter:
                 f'<span title="{", ".join(others)}">{len(others)} others</span></li>'
             )
 
-    def _render_notification(self, notif: Notification) -> str:
-        target_branch = self._target_branch(notif.pr)
-        return f"""\
-<li class="list-group-item {self._li_class(notif)}" style="{self._li_style(notif)}">
-    <p class="mb-1">
-      <small class="lh-2">
-        <span style="float: right; text-align: right;">
-          <span>{humanize.naturaltime(notif.pr.updated_at)}</span>
-          <br>
-          <small>{notif.pr.updated_at}</small>
-        </span>
-        <a href="{notif.url}" target="_blank">{notif.pr.ref}</a>
-        by {notif.pr.author}
-        <br/>
-        <span>{target_branch}</span>
-      </small>
-    </p>
-  <h5 class="mb-1">
-    {notif.pr.title}
-  </h5>
-  <div>
-    <p class="mb-1">
-      {"".join(self._icons(notif))}
-      <span class="text-success">+{notif.pr.additions}</span>
-      <span class="text-danger">−{notif.pr.deletions}</span>
-      in {notif.pr.commits} commits, {notif.pr.files} files.
-    </p>
-    <small>
-      <ul class="list-group list-group-horizontal">
-        {"".join(self._reviewer_list_items(notif))}
-      </ul>
-    </small>
-  </div>
-</li>
-"""
+    def _write_notification(
+        self, parts: list[str], notif: Notification, now: datetime.datetime
+    ) -> None:
+        updated_at = notif.pr.updated_at
+        status = notif.pr.status
+        li_class = self.LI_CLASSES.get(status, "")
+        li_style = self.LI_STYLES.get(status, "")
+        icons = self._icons(
+            status, notif.pr.merge_status, notif.pr.author == notif.user.login
+        )
+        parts.append(
+            self.NOTIFICATION_TEMPLATE
+            % (
+                li_class,
+                li_style,
+                _naturaltime(updated_at, now),
+                updated_at,
+                notif.url,
+                notif.pr.ref,
+                notif.pr.author,
+                self._target_branch(notif.pr),
+                notif.pr.title,
+                "".join(icons),
+                notif.pr.additions,
+                notif.pr.deletions,
+                notif.pr.commits,
+                notif.pr.files,
+                "".join(self._reviewer_list_items(notif)),
+            )
+        )
 
     def format(self, notifications: Sequence[Notification]) -> str:
+        now = datetime.datetime.now()
+
         if self.auto_refresh:
             script = """\
 <script>
@@ -407,7 +519,8 @@ class HtmlFormatter:
         else:
             script = ""
 
-        return f"""\
+        parts = [
+            f"""\
 <!DOCTYPE html>
 <html lang="en" data-bs-theme="{self.theme}">
   <head>
@@ -424,18 +537,25 @@ class HtmlFormatter:
           {len(notifications)} unread notifications
         </span>
         <span class="badge text-bg-dark" style="margin-left: auto;">
-          last updated {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+          last updated {now.strftime('%Y-%m-%d %H:%M:%S')}
         </span>
       </div>
       <ul class="list-group">
-        {"".join(self._render_notification(notification) for notification in notifications)}
+        """  # noqa: E501
+        ]
+        for notification in notifications:
+            self._write_notification(parts, notification, now)
+        parts.append(
+            f"""
       </ul>
     </div>
 
     {script}
   </body>
 </html>
-"""  # noqa: E501
+"""
+        )
+        return "".join(parts)
 
 
 # --------
@@ -449,7 +569,12 @@ class Printer(Protocol):
 
 class ConsolePrinter:
     def print(self, value: str) -> None:
-        print(value)
+        # encode once and hand the whole output to the binary buffer in one write
+        sys.stdout.flush()
+        sys.stdout.buffer.write(
+            f"{value}\n".encode(sys.stdout.encoding, sys.stdout.errors or "strict")
+        )
+        sys.stdout.buffer.flush()
 
 
 class FilePrinter:
@@ -457,8 +582,10 @@ class FilePrinter:
         self.filepath = filepath
 
     def print(self, value: str) -> None:
-        with open(self.filepath, "w") as f:
-            f.write(value)
+        # encode up front so the whole page goes out in a single write
+        data = value.encode()
+        with open(self.filepath, "wb") as f:
+            f.write(data)
 
         logger.info("written to %s", self.filepath)
 
@@ -467,142 +594,304 @@ class FilePrinter:
 # GitHub API
 # ----------
 
+# With an absolute executable path and close_fds=False, subprocess can start gh
+# with posix_spawn instead of fork + exec. Python opens its own files as
+# non-inheritable, so none of them leak into gh.
+GH = shutil.which("gh") or "gh"
 
-def _gh_api(*query: str, paginate: bool = False) -> Any:
-    if paginate:
-        logger.debug("gh api --paginated %s", shlex.join(query))
-        try:
-            data = subprocess.check_output(
-                ("gh", "api", "--paginate", *query),
-                text=True,
-            )
-        except subprocess.CalledProcessError as exc:
-            logger.exception(exc)
-            raise SystemExit(exc.returncode) from exc
-        else:
-            data = data.replace("][", ",")  # join pages
-    else:
-        logger.debug("gh api %s", shlex.join(query))
-        try:
-            data = subprocess.check_output(("gh", "api", *query), text=True)
-        except subprocess.CalledProcessError as exc:
-            logger.exception(exc)
-            raise SystemExit(exc.returncode) from exc
 
-    return json.loads(data)
+def _gh_api_raw(*query: str) -> bytes:
+    logger.debug("gh api %s", shlex.join(query))
+    try:
+        return subprocess.check_output((GH, "api", *query), close_fds=False)
+    except subprocess.CalledProcessError as exc:
+        logger.exception(exc)
+        raise SystemExit(exc.returncode) from exc
+
+
+def _gh_api(*query: str) -> Any:
+    return json_loads(_gh_api_raw(*query))
+
+
+def _gh_api_lines(*query: str) -> list[Any]:
+    # --jq prints each result on its own line (and works across --paginate pages)
+    return [json_loads(line) for line in _gh_api_raw(*query).splitlines()]
 
 
 def _gh_user() -> User:
     user = _gh_api("user")
     user_login = user["login"]
-    user_id = str(user["id"])
 
-    orgs_query = """\
-{
+    # look up the user's teams in every organization in one query
+    teams_query = """\
+query($userLogin: String!) {
   viewer {
-    login
     organizations(first: 100) {
       nodes {
         login
+        teams(userLogins: [$userLogin], first: 100) {
+          nodes {
+            slug
+          }
+        }
       }
     }
   }
 }"""
-    organizations = (
+    organizations = _gh_api(
         # fmt: off
-        node["login"]
-        for node in _gh_api(
-            "graphql",
-            "-f", f"query={orgs_query}"
-        )["data"]["viewer"]["organizations"]["nodes"]
+        "graphql",
+        "-f", f"userLogin={user_login}",
+        "-f", f"query={teams_query}",
         # fmt: on
-    )
-
-    teams_query = """\
-query($orgName: String!, $userLogin: String!) {
-  organization(login: $orgName) {
-    teams(userLogins: [$userLogin], first: 100) {
-      nodes {
-        slug
-      }
-    }
-  }
-}"""
-    teams = {
-        # fmt: off
-        f"{organization}/{node['slug']}"
+    )["data"]["viewer"]["organizations"]["nodes"]
+    team_slugs = {
+        f"{organization['login']}/{node['slug']}": node["slug"]
         for organization in organizations
-        for node in _gh_api(
-            "graphql",
-            "-f", f"orgName={organization}",
-            "-f", f"userLogin={user_login}",
-            "-f", f"query={teams_query}",
-        )["data"]["organization"]["teams"]["nodes"]
-        # fmt: on
+        for node in organization["teams"]["nodes"]
     }
 
     return User(
-        id=user_id,
+        id=str(user["id"]),
         login=user_login,
-        teams=teams,
+        team_slugs=team_slugs,
     )
 
 
+# GitHub answers with gateway errors now and then (e.g. when a big GraphQL query
+# times out); they usually succeed when tried again
+GH_RETRIES = 3
+GH_RETRY_BACKOFF = 0.5  # seconds, doubled after every attempt
+GH_RETRY_ERRORS = (b"HTTP 502", b"HTTP 503", b"HTTP 504")
+
+
 async def _gh_api_async(*query: str) -> Any:
     logger.debug("gh api %s", shlex.join(query))
-    proc = await asyncio.create_subprocess_exec(
-        *("gh", "api", *query),
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
+    attempt = 0
+    while True:
+        proc = await asyncio.create_subprocess_exec(
+            *(GH, "api", *query),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            close_fds=False,
+        )
+
+        stdout, stderr = await proc.communicate()
+        if not proc.returncode:
+            return json_loads(stdout)
+
+        if attempt < GH_RETRIES and any(e in stderr for e in GH_RETRY_ERRORS):
+            delay = GH_RETRY_BACKOFF * 2**attempt
+            attempt += 1
+            logger.debug(
+                "gh api failed, retrying in %ss: %s",
+                delay,
+                stderr.decode(errors="replace").strip(),
+            )
+            await asyncio.sleep(delay)
+            continue
 
-    if await proc.wait():
-        assert proc.stderr  # we pipe stderr to the Process object
-        stderr = await proc.stderr.read()
         logger.error(
             "Command %r returned non-zero exit status %s.",
             ("gh", "api", *query),
             proc.returncode,
         )
-        logger.error(stderr.decode())
+        logger.error(stderr.decode(errors="replace"))
         raise SystemExit(proc.returncode)
 
-    assert proc.stdout  # we pipe stdout to the Process object
-    stdout = await proc.stdout.read()
-    return json.loads(stdout.decode())
 
+PR_FRAGMENT = """\
+fragment pr on PullRequest {
+  title
+  author { login }
+  state
+  isDraft
+  mergeStateStatus
+  autoMergeRequest { enabledAt }
+  baseRepository {
+    owner { login }
+    name
+    defaultBranchRef { name }
+  }
+  baseRefName
+  number
+  url
+  updatedAt
+  reviewRequests(first: 100) {
+    nodes {
+      requestedReviewer {
+        ... on User { login }
+        ... on Bot { login }
+        ... on Mannequin { login }
+        ... on Team { slug }
+      }
+    }
+  }
+  commits { totalCount }
+  changedFiles
+  additions
+  deletions
+}"""
+
+PR_BATCH_SIZE = 50
+MAX_CONCURRENT_REQUESTS = 8
+
+
+async def _gh_pr_batch(
+    urls: Sequence[str], limit: asyncio.Semaphore
+) -> list[dict[str, Any]]:
+    aliases = []
+    for i, url in enumerate(urls):
+        # https://api.github.com/repos/{owner}/{repo}/pulls/{number}
+        _, owner, repo, _, number = url.rsplit("/", 4)
+        aliases.append(
+            f"pr{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(repo)})"
+            f" {{ pullRequest(number: {int(number)}) {{ ...pr }} }}"
+        )
+    # the fragment spares us repeating the PR fields for every alias
+    query = "{\n%s\n}\n%s" % ("\n".join(aliases), PR_FRAGMENT)
+
+    async with limit:
+        data = await _gh_api_async(
+            # fmt: off
+            "graphql",
+            # mergeStateStatus is part of the merge info preview
+            "-H", "Accept: application/vnd.github.merge-info-preview+json",
+            "-f", f"query={query}",
+            # fmt: on
+        )
+    return [data["data"][f"pr{i}"]["pullRequest"] for i in range(len(urls))]
 
-async def _gh_pr(url: str) -> PR:
-    pr_data = await _gh_api_async(url)
-    return PR.from_json(pr_data)
 
+PR_CACHE_PATH = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "gh_notifs.json",
+)
 
-async def _gh_notif(id: str, pr_url: str, user: User) -> Notification:
-    pr = await _gh_pr(pr_url)
-    return Notification(id, user, pr)
+
+def _read_pr_cache() -> dict[str, Any]:
+    try:
+        with open(PR_CACHE_PATH, "rb") as f:
+            cache = json_loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+    # PRs cached with different fields can't be parsed any more
+    if not isinstance(cache, dict) or cache.get("fragment") != PR_FRAGMENT:
+        return {}
+    prs = cache.get("prs")
+    if not isinstance(prs, dict):
+        return {}
+
+    # anything else that doesn't look like a cached PR is a cache miss
+    return {
+        url: entry
+        for url, entry in prs.items()
+        if isinstance(entry, dict)
+        and isinstance(entry.get("updated_at"), str)
+        and isinstance(entry.get("fetched_at"), (int, float))
+        and isinstance(entry.get("data"), dict)
+    }
+
+
+def _write_pr_cache(prs: dict[str, Any]) -> None:
+    # write to a temporary file and move it into place, so that another run
+    # (e.g. the HTML loop next to the console one) never sees a partial file
+    cache_dir = os.path.dirname(PR_CACHE_PATH)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    except OSError as e:
+        logger.warning("could not write PR cache: %s", e)
+        return
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"fragment": PR_FRAGMENT, "prs": prs}, f)
+        os.replace(tmp_path, PR_CACHE_PATH)
+    except OSError as e:
+        logger.warning("could not write PR cache: %s", e)
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+
+
+async def _gh_prs(
+    notifs_data: Sequence[dict[str, str]],
+    limit: asyncio.Semaphore,
+    cache_ttl: float,
+) -> list[PR]:
+    # only fetch each PR once, even if several notifications point at it
+    updated_ats = {
+        notif_data["url"]: notif_data["updated_at"] for notif_data in notifs_data
+    }
+
+    # reuse PRs fetched recently if their notifications haven't been updated since
+    now = time.time()
+    cache = {
+        url: entry
+        for url, entry in (_read_pr_cache() if cache_ttl > 0 else {}).items()
+        if url in updated_ats
+        and entry["updated_at"] == updated_ats[url]
+        and now - entry["fetched_at"] < cache_ttl
+    }
+
+    stale_urls = [url for url in updated_ats if url not in cache]
+    batches = await asyncio.gather(
+        *(
+            _gh_pr_batch(stale_urls[i : i + PR_BATCH_SIZE], limit)
+            for i in range(0, len(stale_urls), PR_BATCH_SIZE)
+        )
+    )
+    for url, data in zip(stale_urls, (data for batch in batches for data in batch)):
+        cache[url] = {"updated_at": updated_ats[url], "fetched_at": now, "data": data}
+
+    if cache_ttl > 0:
+        _write_pr_cache(cache)
+
+    prs = {url: PR.from_graphql(entry["data"]) for url, entry in cache.items()}
+    return [prs[notif_data["url"]] for notif_data in notifs_data]
 
 
 # -----------
 # Application
 # -----------
 
+# let gh drop everything but what we need from the pull request notifications
+PR_NOTIFICATIONS_JQ = (
+    '.[] | select(.subject.type == "PullRequest")'
+    " | {id, url: .subject.url, updated_at}"
+)
 
-async def amain(formatter: Formatter, printer: Printer) -> int:
-    user = _gh_user()
 
-    notifs_data = (
-        n
-        for n in _gh_api("notifications", paginate=True)
-        if n["subject"]["type"] == "PullRequest"
-    )
+async def amain(
+    formatter: Formatter,
+    printer: Printer,
+    cache_ttl: float,
+    participating: bool,
+) -> int:
+    # don't run more gh processes at once than GitHub will happily serve
+    limit = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-    notifications = await asyncio.gather(
-        *(
-            _gh_notif(notif_data["id"], notif_data["subject"]["url"], user)
-            for notif_data in notifs_data
-        )
+    # the user's details aren't needed until the end, so look them up in a worker
+    # thread while the notifications and their PRs are being fetched
+    user_task = asyncio.create_task(asyncio.to_thread(_gh_user))
+
+    notifs_data = await asyncio.to_thread(
+        # fmt: off
+        _gh_api_lines,
+        "--paginate",
+        "notifications?participating=true" if participating else "notifications",
+        "--jq", PR_NOTIFICATIONS_JQ,
+        # fmt: on
     )
 
+    prs = await _gh_prs(notifs_data, limit, cache_ttl)
+    user = await user_task
+    notifications = [
+        Notification(notif_data["id"], user, pr)
+        for notif_data, pr in zip(notifs_data, prs)
+    ]
+
     printer.print(formatter.format(notifications))
 
     return 0
@@ -645,6 +934,25 @@ def main(argv: Sequence[str] | None = None) -> int:
         help="color theme for HTML output (default: %(default)s)",
     )
 
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help=(
+            "reuse PR details fetched this recently if their notification hasn't"
+            " been updated since; merge and review state can be this stale, because"
+            " they change without updating the notification (default: %(default)s,"
+            " no cache)"
+        ),
+    )
+
+    parser.add_argument(
+        "--participating",
+        action="store_true",
+        help="only show notifications for PRs you are participating in or mentioned on",
+    )
+
     parser.set_defaults(formatter=ConsoleFormatter)
     args = parser.parse_args(argv)
 
@@ -663,7 +971,7 @@ def main(argv: Sequence[str] | None = None) -> int:
     else:
         printer = ConsolePrinter()
 
-    return asyncio.run(amain(formatter, printer))
+    return asyncio.run(amain(formatter, printer, args.cache_ttl, args.participating))
 
 
 if __name__ == "__main__":